@@ -1,30 +1,51 @@
 """Claude Code Chat - A web frontend for Claude Code CLI with authentication and sessions."""
 
 import os
+import json
+import threading
 import subprocess
 
-from flask import Flask, render_template, request, jsonify, make_response
+from cachetools import LRUCache
+from flask import Flask, Response, g, render_template, request, jsonify, make_response
 from dotenv import load_dotenv
 
-from models import init_db, User, Conversation, Message
+# Load .env before importing modules that read their settings at import time
+load_dotenv()
+
+import claude_stream
+from models import init_db, encode_id, User, Conversation, Message
 from auth import (
     authenticate_token, create_session, get_session, delete_session,
     require_auth, optional_auth, get_current_user, get_current_session,
-    cleanup_expired_sessions
+    cleanup_expired_sessions, is_oauth_token, get_anthropic_token
 )
 
-load_dotenv()
-
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", os.urandom(24))
 
 # Configuration
 TIMEOUT = int(os.getenv("CLAUDE_TIMEOUT", 120))
 SYSTEM_PROMPT = os.getenv("SYSTEM_PROMPT", "You are a helpful assistant. Be concise and clear.")
+# Number of most recent messages included as history in each prompt
+HISTORY_LIMIT = int(os.getenv("HISTORY_LIMIT", 50))
+# Keep one long-lived CLI process per session instead of spawning one per message
+CLAUDE_STREAM_MODE = os.getenv("CLAUDE_STREAM_MODE", "false").lower() == "true"
+
+# Environment for CLI subprocesses, snapshotted once instead of copied per request.
+# Server-level credentials are dropped so only the session's own token is used.
+_BASE_ENV = {
+    key: value for key, value in os.environ.items()
+    if key not in ("ANTHROPIC_API_KEY", "CLAUDE_CODE_OAUTH_TOKEN")
+}
 
 # Initialize database on startup
 init_db()
 
+# Serialized conversation lists keyed by (user_id, Conversation.list_version()).
+# Any change to a user's conversations changes the key, so entries never go stale.
+_conversation_list_cache = LRUCache(maxsize=1024)
+_conversation_list_lock = threading.Lock()
+
 
 # ============================================================================
 # Authentication Endpoints
@@ -62,7 +83,7 @@ def login():
         user.update_last_login()
 
         # Create session
-        session_token = create_session(user.id, token)
+        session_token = create_session(encode_id(user.id), token)
 
         response = make_response(jsonify({
             "success": True,
@@ -89,10 +110,10 @@ def login():
 @require_auth
 def logout():
     """Log out the current user and invalidate their session."""
-    from flask import g
     session_token = getattr(g, 'session_token', None)
     if session_token:
         delete_session(session_token)
+        claude_stream.close_session(session_token)
 
     response = make_response(jsonify({"success": True}))
     response.delete_cookie("session_token")
@@ -132,11 +153,24 @@ def me():
 def list_conversations():
     """List all conversations for the current user."""
     user = get_current_user()
-    conversations = Conversation.get_by_user(user.id)
-    return jsonify({
-        "success": True,
-        "conversations": [c.to_dict() for c in conversations]
-    })
+    key = (user.id, Conversation.list_version(user.id))
+
+    with _conversation_list_lock:
+        body = _conversation_list_cache.get(key)
+
+    if body is None:
+        conversations = Conversation.get_by_user(user.id)
+        body = app.json.dumps({
+            "success": True,
+            "conversations": [c.to_dict() for c in conversations]
+        })
+        # Only cache if nothing changed while the list was read, otherwise
+        # a newer list would be stored under the older version
+        if Conversation.list_version(user.id) == key[1]:
+            with _conversation_list_lock:
+                _conversation_list_cache[key] = body
+
+    return Response(body, mimetype="application/json")
 
 
 @app.route("/api/conversations", methods=["POST"])
@@ -159,7 +193,7 @@ def create_conversation():
 def get_conversation(conversation_id):
     """Get a specific conversation with its messages."""
     user = get_current_user()
-    conversation = Conversation.get_by_id(conversation_id)
+    conversation = Conversation.get_with_messages(conversation_id)
 
     if not conversation:
         return jsonify({"success": False, "error": "Conversation not found"}), 404
@@ -210,6 +244,7 @@ def delete_conversation(conversation_id):
         return jsonify({"success": False, "error": "Access denied"}), 403
 
     conversation.delete()
+    claude_stream.close_conversation(conversation.id)
     return jsonify({"success": True})
 
 
@@ -217,6 +252,63 @@ def delete_conversation(conversation_id):
 # Chat Endpoint (Updated with authentication and persistence)
 # ============================================================================
 
+def _get_or_create_conversation(user, conversation_id, message):
+    """
+    Resolve the conversation a chat message belongs to.
+
+    Returns None if the conversation exists but belongs to another user.
+    """
+    conversation = None
+    if conversation_id:
+        conversation = Conversation.get_by_id(conversation_id)
+        if conversation and conversation.user_id != user.id:
+            return None
+
+    if not conversation:
+        # Create new conversation with first message as title
+        title = message[:50] + "..." if len(message) > 50 else message
+        conversation = Conversation.create(user_id=user.id, title=title)
+
+    return conversation
+
+
+def _build_prompt(history, message):
+    """Build the CLI prompt from the system prompt, history and new message."""
+    parts = [f"{SYSTEM_PROMPT}\n"]
+
+    if history:
+        parts.append("Previous conversation:")
+        parts.extend(
+            f"{'User' if msg.role == 'user' else 'Assistant'}: {msg.content}\n"
+            for msg in history
+        )
+
+    parts.append(f"User: {message}")
+    return "\n".join(parts)
+
+
+def _last_user_message_id(history):
+    """Id of the most recent user message in history, or None."""
+    return next((msg.id for msg in reversed(history) if msg.role == "user"), None)
+
+
+def _claude_env(session):
+    """Build the CLI environment with the Anthropic token from the session."""
+    anthropic_token = get_anthropic_token(session)
+    if not anthropic_token:
+        return _BASE_ENV
+
+    # Check if it's an OAuth token or API key and set appropriate env var
+    if is_oauth_token(anthropic_token):
+        return {**_BASE_ENV, "CLAUDE_CODE_OAUTH_TOKEN": anthropic_token}
+    return {**_BASE_ENV, "ANTHROPIC_API_KEY": anthropic_token}
+
+
+def _sse(payload):
+    """Format a payload as a Server-Sent Events data frame."""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
 @app.route("/api/chat", methods=["POST"])
 @require_auth
 def chat():
@@ -239,62 +331,41 @@ def chat():
             return jsonify({"success": False, "error": "No message provided"}), 400
 
         # Get or create conversation
-        conversation = None
-        if conversation_id:
-            conversation = Conversation.get_by_id(conversation_id)
-            if conversation and conversation.user_id != user.id:
-                return jsonify({"success": False, "error": "Access denied"}), 403
-
+        conversation = _get_or_create_conversation(user, conversation_id, message)
         if not conversation:
-            # Create new conversation with first message as title
-            title = message[:50] + "..." if len(message) > 50 else message
-            conversation = Conversation.create(user_id=user.id, title=title)
-
-        # Get conversation history
-        history = conversation.get_messages()
+            return jsonify({"success": False, "error": "Access denied"}), 403
 
         # Build prompt with conversation history
-        prompt = f"{SYSTEM_PROMPT}\n\n"
-
-        if history:
-            prompt += "Previous conversation:\n"
-            for msg in history:
-                role = "User" if msg.role == "user" else "Assistant"
-                prompt += f"{role}: {msg.content}\n\n"
-
-        prompt += f"User: {message}"
+        history = conversation.get_messages(HISTORY_LIMIT)
+        prompt = _build_prompt(history, message)
 
         # Save user message
-        Message.create(
+        user_message = Message.create(
             conversation_id=conversation.id,
             role="user",
             content=message
         )
 
-        # Set the Anthropic token from the session for the CLI
-        env = os.environ.copy()
-        anthropic_token = session.get("anthropic_token")
-        if anthropic_token:
-            # Check if it's an OAuth token or API key and set appropriate env var
-            if anthropic_token.startswith("ant-oa-") or anthropic_token.startswith("sk-ant-oa"):
-                env["CLAUDE_CODE_OAUTH_TOKEN"] = anthropic_token
-            else:
-                env["ANTHROPIC_API_KEY"] = anthropic_token
-
-        # Use Claude Code CLI in print mode (-p)
-        result = subprocess.run(
-            ["claude", "-p", prompt],
-            capture_output=True,
-            text=True,
-            timeout=TIMEOUT,
-            env=env
-        )
+        if CLAUDE_STREAM_MODE:
+            assistant_response = "".join(claude_stream.stream_reply(
+                g.session_token, conversation.id, _last_user_message_id(history),
+                user_message.id, prompt, message, _claude_env(session), TIMEOUT
+            )).strip()
+        else:
+            # Use Claude Code CLI in print mode (-p)
+            result = subprocess.run(
+                ["claude", "-p", prompt],
+                capture_output=True,
+                text=True,
+                timeout=TIMEOUT,
+                env=_claude_env(session)
+            )
 
-        if result.returncode != 0:
-            error_msg = result.stderr or result.stdout or "Claude Code failed"
-            return jsonify({"success": False, "error": error_msg}), 500
+            if result.returncode != 0:
+                error_msg = result.stderr or result.stdout or "Claude Code failed"
+                return jsonify({"success": False, "error": error_msg}), 500
 
-        assistant_response = result.stdout.strip()
+            assistant_response = result.stdout.strip()
 
         # Save assistant response
         Message.create(
@@ -306,7 +377,7 @@ def chat():
         return jsonify({
             "success": True,
             "response": assistant_response,
-            "conversation_id": conversation.id
+            "conversation_id": encode_id(conversation.id)
         })
 
     except subprocess.TimeoutExpired:
@@ -317,6 +388,78 @@ def chat():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@app.route("/api/chat/stream", methods=["POST"])
+@require_auth
+def chat_stream():
+    """
+    Chat with Claude, streaming the response as Server-Sent Events.
+
+    Request body: same as /api/chat.
+    Events: {"conversation_id": ...}, then {"token": ...} for each text
+    chunk, and finally {"done": true} or {"error": ...}.
+    """
+    user = get_current_user()
+    session = get_current_session()
+    data = request.get_json() or {}
+    message = data.get("message", "")
+
+    if not message:
+        return jsonify({"success": False, "error": "No message provided"}), 400
+
+    conversation = _get_or_create_conversation(user, data.get("conversation_id"), message)
+    if not conversation:
+        return jsonify({"success": False, "error": "Access denied"}), 403
+
+    history = conversation.get_messages(HISTORY_LIMIT)
+    prompt = _build_prompt(history, message)
+    user_message = Message.create(conversation_id=conversation.id, role="user", content=message)
+    env = _claude_env(session)
+
+    if CLAUDE_STREAM_MODE:
+        replies = claude_stream.stream_reply(
+            g.session_token, conversation.id, _last_user_message_id(history),
+            user_message.id, prompt, message, env, TIMEOUT
+        )
+    else:
+        replies = claude_stream.stream_once(prompt, env, TIMEOUT)
+
+    def generate():
+        yield _sse({"conversation_id": encode_id(conversation.id)})
+
+        chunks = []
+        error = None
+        try:
+            for text in replies:
+                chunks.append(text)
+                yield _sse({"token": text})
+        except subprocess.TimeoutExpired:
+            error = "Request timed out"
+        except FileNotFoundError:
+            error = "Claude Code CLI not found. Please install it first."
+        except Exception as e:
+            error = str(e)
+        finally:
+            # Runs on completion, error, or client disconnect. A failed reply
+            # is not saved, as in /api/chat; a disconnected one keeps its text.
+            replies.close()
+
+            assistant_response = "".join(chunks).strip()
+            if error is None and assistant_response:
+                Message.create(
+                    conversation_id=conversation.id,
+                    role="assistant",
+                    content=assistant_response
+                )
+
+        yield _sse({"error": error} if error else {"done": True})
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # ============================================================================
 # Legacy/Public Endpoints
 # ============================================================================
@@ -1,26 +1,110 @@
 """Authentication system for Claude Code Chat using Anthropic OAuth tokens."""
 
 import os
+import re
+import json
+import time
 import uuid
+import heapq
 import secrets
 import hashlib
-from datetime import datetime, timedelta
+import threading
 from typing import Optional
 from functools import wraps
 
 import requests
+from cachetools import TTLCache
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from flask import request, jsonify, g
 
 from models import User
 
-# In-memory session storage
-# Format: {session_token: {user_id, anthropic_token, created_at, expires_at}}
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# In-memory session storage, used when REDIS_URL is not set
+# Format: {session_token: {user_id, token_ref, created_at, expires_at}}
+# Timestamps are epoch seconds (floats).
 sessions = {}
 
+# Encrypted Anthropic tokens, kept apart from session data
+# Format: {token_ref: Fernet ciphertext}
+_tokens = {}
+
+# Min-heap of (expires_at, session_token) so cleanup only visits expired sessions
+_expiry_heap = []
+_sessions_lock = threading.Lock()
+
 # Session configuration
 SESSION_DURATION_HOURS = int(os.getenv("SESSION_DURATION_HOURS", 24))
 ANTHROPIC_API_BASE = "https://api.anthropic.com"
 
+# Probe the Anthropic API to confirm a token works before creating a session.
+# When disabled, well-formed tokens are accepted and checked on first chat instead.
+ANTHROPIC_VERIFY_ON_LOGIN = os.getenv("ANTHROPIC_VERIFY_ON_LOGIN", "true").lower() == "true"
+
+# Statuses that mean the token itself was refused. Anything else (rate limits,
+# server errors) says nothing about the token, so it is not cached as invalid.
+_REJECTED_STATUSES = (401, 403)
+
+# Shape of API keys and OAuth tokens, checked before any network call
+_TOKEN_PATTERN = re.compile(
+    r"^(sk-ant-[A-Za-z0-9_\-]{80,}|ant-oa-[A-Za-z0-9_\-]{40,}|sk-ant-oa[A-Za-z0-9_\-]{40,})$"
+)
+
+# Shared Redis session store, so sessions work across workers and restarts
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_SESSION_PREFIX = "cc-chat:session:"
+REDIS_TOKEN_PREFIX = "cc-chat:token:"
+
+# Comma-separated Fernet keys for encrypting stored Anthropic tokens. The first
+# key encrypts; all of them decrypt, so keys can be rotated by prepending a new one.
+SESSION_ENCRYPTION_KEYS = [k.strip() for k in os.getenv("SESSION_ENCRYPTION_KEY", "").split(",") if k.strip()]
+
+
+def _connect_redis():
+    """Connect to the Redis session store if REDIS_URL is configured."""
+    if not REDIS_URL:
+        return None
+    if redis is None:
+        raise ImportError("REDIS_URL is set but the redis package is not installed (pip install redis)")
+    return redis.Redis.from_url(REDIS_URL)
+
+
+_redis = _connect_redis()
+
+
+def _load_fernet() -> MultiFernet:
+    """Build the cipher for stored tokens from SESSION_ENCRYPTION_KEY."""
+    if SESSION_ENCRYPTION_KEYS:
+        return MultiFernet([Fernet(key) for key in SESSION_ENCRYPTION_KEYS])
+    if _redis is not None:
+        raise RuntimeError("SESSION_ENCRYPTION_KEY must be set when using REDIS_URL")
+    # In-memory tokens don't outlive the process, so a per-process key is enough
+    return MultiFernet([Fernet(Fernet.generate_key())])
+
+
+_fernet = _load_fernet()
+
+# Shared HTTP session so token validation reuses pooled TLS connections
+_http = requests.Session()
+_http.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=50,
+    max_retries=Retry(total=2, backoff_factor=0.1)
+))
+_http.headers["anthropic-version"] = "2023-06-01"
+
+# Recent validation results keyed by token hash, so repeat logins skip the API probe.
+# Rejections are cached only briefly so a fixed or rotated key is not locked out.
+_valid_tokens = TTLCache(maxsize=10_000, ttl=300)
+_invalid_tokens = TTLCache(maxsize=10_000, ttl=30)
+_token_cache_lock = threading.Lock()
+
 
 def generate_session_token() -> str:
     """Generate a secure session token."""
@@ -32,50 +116,61 @@ def hash_token(token: str) -> str:
     return hashlib.sha256(token.encode()).hexdigest()
 
 
-def validate_anthropic_token(token: str) -> Optional[dict]:
-    """
-    Validate an Anthropic OAuth token by making a test API request.
+def is_oauth_token(token: str) -> bool:
+    """Check whether a token is an OAuth token rather than an API key."""
+    return token.startswith("ant-oa-") or token.startswith("sk-ant-oa")
 
-    Returns user info dict if valid, None if invalid.
-    """
-    headers = {
-        "x-api-key": token,
-        "anthropic-version": "2023-06-01",
-        "content-type": "application/json"
+
+def _user_info(token: str) -> dict:
+    """Build the user info for a token, using a hash of the token as user identifier."""
+    token_hash = hash_token(token)
+    if is_oauth_token(token):
+        anthropic_user_id = f"oauth_{token_hash[:28]}"
+    else:
+        anthropic_user_id = token_hash[:32]  # Use first 32 chars of hash as ID
+
+    return {
+        "anthropic_user_id": anthropic_user_id,
+        "email": None,  # Anthropic doesn't expose email via API key auth
+        "name": None
     }
 
-    try:
-        # Make a minimal API request to validate the token
-        # Using the messages API with a tiny request
-        response = requests.post(
-            f"{ANTHROPIC_API_BASE}/v1/messages",
-            headers=headers,
-            json={
-                "model": "claude-3-haiku-20240307",
-                "max_tokens": 1,
-                "messages": [{"role": "user", "content": "hi"}]
-            },
-            timeout=10
-        )
-
-        if response.status_code == 200:
-            # Token is valid - extract user info from response if available
-            # For now, we use a hash of the token as user identifier
-            token_hash = hash_token(token)
-            return {
-                "anthropic_user_id": token_hash[:32],  # Use first 32 chars of hash as ID
-                "email": None,  # Anthropic doesn't expose email via API key auth
-                "name": None
-            }
-        elif response.status_code == 401:
-            return None
-        else:
-            # Other errors (rate limit, etc.) - token might still be valid
-            # But we'll reject to be safe
-            return None
 
-    except requests.RequestException:
+def _check_response(token: str, response: requests.Response) -> Optional[dict]:
+    """Map a validation response to user info, None if the token was refused, or an error."""
+    if response.status_code == 200:
+        return _user_info(token)
+    if response.status_code in _REJECTED_STATUSES:
         return None
+    raise requests.HTTPError(
+        f"Token validation failed with status {response.status_code}",
+        response=response
+    )
+
+
+def validate_anthropic_token(token: str) -> Optional[dict]:
+    """
+    Validate an Anthropic OAuth token by making a test API request.
+
+    Returns user info dict if valid, None if invalid. Raises
+    requests.RequestException if the API couldn't give an answer (network
+    failure, rate limit, server error).
+    """
+    headers = {"x-api-key": token}
+
+    # Make a minimal API request to validate the token
+    # Using the messages API with a tiny request
+    response = _http.post(
+        f"{ANTHROPIC_API_BASE}/v1/messages",
+        headers=headers,
+        json={
+            "model": "claude-3-haiku-20240307",
+            "max_tokens": 1,
+            "messages": [{"role": "user", "content": "hi"}]
+        },
+        timeout=10
+    )
+    return _check_response(token, response)
 
 
 def validate_anthropic_oauth_token(token: str) -> Optional[dict]:
@@ -83,115 +178,193 @@ def validate_anthropic_oauth_token(token: str) -> Optional[dict]:
     Validate an Anthropic OAuth token.
 
     OAuth tokens start with 'ant-oa-' prefix and work differently from API keys.
+    Raises requests.RequestException like validate_anthropic_token.
     """
     headers = {
         "Authorization": f"Bearer {token}",
-        "anthropic-version": "2023-06-01",
-        "anthropic-beta": "oauth-2025-04-20",
-        "content-type": "application/json"
+        "anthropic-beta": "oauth-2025-04-20"
     }
 
-    try:
-        # Test the OAuth token with a minimal request
-        response = requests.post(
-            f"{ANTHROPIC_API_BASE}/v1/messages",
-            headers=headers,
-            json={
-                "model": "claude-sonnet-4-20250514",
-                "max_tokens": 1,
-                "messages": [{"role": "user", "content": "hi"}]
-            },
-            timeout=10
-        )
-
-        if response.status_code == 200:
-            token_hash = hash_token(token)
-            return {
-                "anthropic_user_id": f"oauth_{token_hash[:28]}",
-                "email": None,
-                "name": None
-            }
-        else:
-            return None
-
-    except requests.RequestException:
-        return None
+    # Test the OAuth token with a minimal request
+    response = _http.post(
+        f"{ANTHROPIC_API_BASE}/v1/messages",
+        headers=headers,
+        json={
+            "model": "claude-sonnet-4-20250514",
+            "max_tokens": 1,
+            "messages": [{"role": "user", "content": "hi"}]
+        },
+        timeout=10
+    )
+    return _check_response(token, response)
 
 
 def authenticate_token(token: str) -> Optional[dict]:
     """
     Authenticate a token - supports both API keys and OAuth tokens.
 
-    Returns user info dict if valid, None if invalid.
+    Returns user info dict if valid, None if invalid. Malformed tokens are
+    rejected without a network call, and results are cached briefly so
+    repeated logins with the same token don't hit the API. Transient API
+    failures reject the login but are not cached.
     """
-    if not token:
+    if not token or not _TOKEN_PATTERN.match(token):
         return None
 
-    # Check token type and validate accordingly
-    if token.startswith("ant-oa-") or token.startswith("sk-ant-oa"):
-        # OAuth token
-        return validate_anthropic_oauth_token(token)
-    elif token.startswith("sk-ant-"):
-        # Standard API key
-        return validate_anthropic_token(token)
-    else:
-        # Try as API key first, then OAuth
-        result = validate_anthropic_token(token)
+    if not ANTHROPIC_VERIFY_ON_LOGIN:
+        return _user_info(token)
+
+    key = hash_token(token)
+    with _token_cache_lock:
+        cached = _valid_tokens.get(key)
+        if cached:
+            return dict(cached)
+        if key in _invalid_tokens:
+            return None
+
+    try:
+        result = _validate_token(token)
+    except requests.RequestException:
+        # The API couldn't answer; fail this login without remembering it
+        return None
+
+    with _token_cache_lock:
         if result:
-            return result
+            _valid_tokens[key] = result
+        else:
+            _invalid_tokens[key] = True
+
+    return dict(result) if result else None
+
+
+def _validate_token(token: str) -> Optional[dict]:
+    """Validate a token against the Anthropic API based on its type."""
+    if is_oauth_token(token):
         return validate_anthropic_oauth_token(token)
+    return validate_anthropic_token(token)
 
 
 def create_session(user_id: str, anthropic_token: str) -> str:
     """Create a new session for a user."""
     session_token = generate_session_token()
-    now = datetime.utcnow()
-    expires_at = now + timedelta(hours=SESSION_DURATION_HOURS)
+    now = time.time()
+    expires_at = now + SESSION_DURATION_HOURS * 3600
+
+    # The session only references the token; the token itself is stored encrypted
+    token_ref = secrets.token_hex(16)
+    encrypted_token = _fernet.encrypt(anthropic_token.encode())
 
-    sessions[session_token] = {
+    session = {
         "user_id": user_id,
-        "anthropic_token": anthropic_token,
-        "created_at": now.isoformat(),
-        "expires_at": expires_at.isoformat()
+        "token_ref": token_ref,
+        "created_at": now,
+        "expires_at": expires_at
     }
 
+    if _redis is not None:
+        # Redis expires the keys itself, so no cleanup sweep is needed
+        ttl = SESSION_DURATION_HOURS * 3600
+        pipe = _redis.pipeline()
+        pipe.setex(REDIS_TOKEN_PREFIX + token_ref, ttl, encrypted_token)
+        pipe.setex(REDIS_SESSION_PREFIX + session_token, ttl, json.dumps(session))
+        pipe.execute()
+    else:
+        with _sessions_lock:
+            _tokens[token_ref] = encrypted_token
+            sessions[session_token] = session
+            heapq.heappush(_expiry_heap, (expires_at, session_token))
+
     return session_token
 
 
 def get_session(session_token: str) -> Optional[dict]:
-    """Get session data if valid and not expired."""
-    if session_token not in sessions:
-        return None
+    """
+    Get session data if valid and not expired.
+
+    Sessions from before tokens were stored encrypted carry the token itself
+    instead of a token_ref; they are deleted, so the user logs in again.
+    """
+    if _redis is not None:
+        key = REDIS_SESSION_PREFIX + session_token
+        data = _redis.get(key)
+        if not data:
+            return None
+        session = json.loads(data)
+        if not session.get("token_ref"):
+            _redis.delete(key)
+            return None
+        return session
 
-    session = sessions[session_token]
-    expires_at = datetime.fromisoformat(session["expires_at"])
+    session = sessions.get(session_token)
+    if session is None:
+        return None
 
-    if datetime.utcnow() > expires_at:
-        # Session expired, remove it
-        del sessions[session_token]
+    if time.time() > session["expires_at"] or not session.get("token_ref"):
+        # Session expired (or has no token_ref), remove it
+        _drop_session(session_token)
         return None
 
     return session
 
 
+def get_anthropic_token(session: dict) -> Optional[str]:
+    """Decrypt the Anthropic token referenced by a session."""
+    token_ref = session.get("token_ref")
+    if not token_ref:
+        return None
+
+    if _redis is not None:
+        encrypted_token = _redis.get(REDIS_TOKEN_PREFIX + token_ref)
+    else:
+        encrypted_token = _tokens.get(token_ref)
+
+    if not encrypted_token:
+        return None
+    try:
+        return _fernet.decrypt(encrypted_token).decode()
+    except InvalidToken:
+        return None
+
+
+def _drop_session(session_token: str) -> bool:
+    """Remove an in-memory session and its stored token."""
+    session = sessions.pop(session_token, None)
+    if session is None:
+        return False
+    _tokens.pop(session.get("token_ref"), None)
+    return True
+
+
 def delete_session(session_token: str) -> bool:
     """Delete a session (logout)."""
-    if session_token in sessions:
-        del sessions[session_token]
+    if _redis is not None:
+        session = get_session(session_token)
+        if session is None:
+            return False
+        keys = [REDIS_SESSION_PREFIX + session_token]
+        if session.get("token_ref"):
+            keys.append(REDIS_TOKEN_PREFIX + session["token_ref"])
+        _redis.delete(*keys)
         return True
-    return False
+
+    # Its heap entry is left behind and discarded when it comes due
+    return _drop_session(session_token)
 
 
 def cleanup_expired_sessions():
     """Remove all expired sessions from memory."""
-    now = datetime.utcnow()
-    expired = [
-        token for token, session in sessions.items()
-        if datetime.fromisoformat(session["expires_at"]) < now
-    ]
-    for token in expired:
-        del sessions[token]
-    return len(expired)
+    if _redis is not None:
+        # Redis expires sessions on its own
+        return 0
+
+    now = time.time()
+    removed = 0
+    with _sessions_lock:
+        while _expiry_heap and _expiry_heap[0][0] < now:
+            _, token = heapq.heappop(_expiry_heap)
+            if _drop_session(token):
+                removed += 1
+    return removed
 
 
 def get_current_user() -> Optional[User]:
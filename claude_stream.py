@@ -0,0 +1,354 @@
+"""Claude Code CLI processes streaming replies as stream-json, run once per message or kept alive for a session."""
+
+import os
+import json
+import time
+import queue
+import signal
+import threading
+import subprocess
+from collections import OrderedDict, deque
+from typing import Iterator, Optional
+
+# Idle processes are reaped after this many minutes without a message
+IDLE_TIMEOUT_MINUTES = int(os.getenv("CLAUDE_STREAM_IDLE_MINUTES", 30))
+REAP_INTERVAL_SECONDS = 60
+# Upper bound on live processes across all sessions; least recently used idle ones are closed first
+MAX_PROCESSES = int(os.getenv("CLAUDE_STREAM_MAX_PROCESSES", 16))
+
+CLAUDE_PRINT_COMMAND = [
+    "claude", "--print",
+    "--output-format", "stream-json",
+    "--include-partial-messages",
+    "--verbose"
+]
+CLAUDE_STREAM_COMMAND = [
+    "claude", "--print",
+    "--input-format", "stream-json",
+    "--output-format", "stream-json",
+    "--include-partial-messages",
+    "--verbose"
+]
+
+
+def _popen(command: list, env: dict, **kwargs) -> subprocess.Popen:
+    """
+    Start the CLI with stdout (and stderr, for error messages) as a text pipe.
+
+    It gets its own process group, so _kill_process_group also stops
+    anything the CLI spawned and stdout reaches EOF instead of staying open
+    in a grandchild.
+    """
+    return subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        bufsize=1,
+        text=True,
+        env=env,
+        start_new_session=True,
+        **kwargs
+    )
+
+
+def _kill_process_group(proc: subprocess.Popen):
+    """Kill a CLI process started by _popen and everything it spawned."""
+    # Once reaped, the pid may belong to something else
+    if proc.returncode is None:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def _frame_text(frame: dict) -> Optional[str]:
+    """Return the text of a partial-message delta frame, or None for any other frame."""
+    if frame.get("type") != "stream_event":
+        return None
+    event = frame.get("event", {})
+    delta = event.get("delta", {})
+    if event.get("type") == "content_block_delta" and delta.get("type") == "text_delta":
+        return delta["text"]
+    return None
+
+
+def _result_text(result: dict, streamed: bool) -> Iterator[str]:
+    """Raise if a result frame reports an error, else yield its text if nothing was streamed."""
+    if result.get("is_error"):
+        raise RuntimeError(result.get("result") or "Claude Code failed")
+    if not streamed and result.get("result"):
+        # No partial messages were emitted; send the full text at once
+        yield result["result"]
+
+
+def stream_once(prompt: str, env: dict, timeout: float) -> Iterator[str]:
+    """
+    Run the CLI once in print mode and yield the reply's text chunks.
+
+    Raises subprocess.TimeoutExpired if the CLI runs longer than timeout, or
+    RuntimeError if it fails.
+    """
+    proc = _popen(CLAUDE_PRINT_COMMAND + [prompt], env)
+
+    # Popen has no overall timeout, so kill the CLI if it runs too long
+    timer = threading.Timer(timeout, _kill_process_group, [proc])
+    timer.start()
+
+    try:
+        streamed = False
+        result = None
+        stray_output = []
+        for line in proc.stdout:
+            try:
+                frame = json.loads(line)
+            except ValueError:
+                stray_output.append(line)
+                continue
+
+            text = _frame_text(frame)
+            if text is not None:
+                streamed = True
+                yield text
+            elif frame.get("type") == "result":
+                result = frame
+
+        proc.wait()
+
+        if not timer.is_alive():
+            raise subprocess.TimeoutExpired(proc.args, timeout)
+        if result is None or proc.returncode != 0:
+            raise RuntimeError((result or {}).get("result") or "".join(stray_output) or "Claude Code failed")
+
+        yield from _result_text(result, streamed)
+    finally:
+        timer.cancel()
+        if proc.poll() is None:
+            _kill_process_group(proc)
+            proc.wait()
+
+
+class SessionProcess:
+    """A persistent `claude` process fed user messages as stream-json frames."""
+
+    def __init__(self, conversation_id: bytes, env: dict):
+        self.proc = _popen(CLAUDE_STREAM_COMMAND, env, stdin=subprocess.PIPE)
+        self.conversation_id = conversation_id
+        self.events = queue.Queue()
+        # Last non-JSON output lines, reported if the process exits
+        self.stray_output = deque(maxlen=20)
+        self.lock = threading.Lock()
+        self.turns = 0
+        # Id of the last user message this process answered
+        self.last_message_id = None
+        self.last_used = time.monotonic()
+        # Requests currently holding this process; guarded by _processes_lock
+        self.users = 0
+
+        self.reader = threading.Thread(target=self._read_frames, daemon=True)
+        self.reader.start()
+
+    def _read_frames(self):
+        """Split stdout into JSONL frames and queue the ones a turn cares about."""
+        for line in self.proc.stdout:
+            try:
+                frame = json.loads(line)
+            except ValueError:
+                self.stray_output.append(line)
+                continue
+
+            text = _frame_text(frame)
+            if text is not None:
+                self.events.put(("token", text))
+            elif frame.get("type") == "result":
+                self.events.put(("result", frame))
+
+        # stdout closed - the process has exited
+        self.events.put(("exit", None))
+
+    def is_alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def holds(self, conversation_id: bytes, previous_id: Optional[bytes]) -> bool:
+        """
+        Check whether the process is alive and has seen the conversation up to previous_id.
+
+        previous_id is the id of the conversation's last user message before
+        the new one. If it isn't the message this process last answered,
+        another session has posted to the conversation since.
+        """
+        if not self.is_alive() or self.conversation_id != conversation_id:
+            return False
+        return not self.turns or self.last_message_id == previous_id
+
+    def stream(self, prompt: str, message: str, message_id: bytes, timeout: float) -> Iterator[str]:
+        """
+        Send one user turn and yield the reply's text chunks.
+
+        A process that has not completed a turn yet has no context, so it is
+        sent the full prompt (system prompt and history); afterwards it
+        already holds the conversation and only needs the new message.
+
+        Raises subprocess.TimeoutExpired if the reply takes longer than
+        timeout, or RuntimeError if the CLI reports an error or exits. A turn
+        that is not read to completion leaves the process unusable, so it is
+        killed rather than reused.
+        """
+        with self.lock:
+            self.last_used = time.monotonic()
+            deadline = self.last_used + timeout
+            content = message if self.turns else prompt
+            completed = False
+
+            try:
+                self.proc.stdin.write(json.dumps({
+                    "type": "user",
+                    "message": {"role": "user", "content": content}
+                }) + "\n")
+                self.proc.stdin.flush()
+
+                streamed = False
+                while True:
+                    try:
+                        kind, value = self.events.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        raise subprocess.TimeoutExpired(CLAUDE_STREAM_COMMAND, timeout)
+
+                    if kind == "token":
+                        streamed = True
+                        yield value
+                    elif kind == "result":
+                        yield from _result_text(value, streamed)
+                        completed = True
+                        break
+                    else:
+                        raise RuntimeError(self._exit_message())
+            except BrokenPipeError:
+                raise RuntimeError(self._exit_message())
+            finally:
+                if completed:
+                    self.turns += 1
+                    self.last_message_id = message_id
+                    self.last_used = time.monotonic()
+                else:
+                    self.close()
+
+    def _exit_message(self) -> str:
+        # Let the reader collect what the process printed before exiting
+        self.reader.join(timeout=1)
+        return "".join(self.stray_output) or "Claude Code exited unexpectedly"
+
+    def close(self):
+        """Terminate the process and its process group."""
+        _kill_process_group(self.proc)
+        self.proc.wait()
+
+
+# One process per session, restarted when the session switches conversation.
+# Ordered least recently used first. Format: {session_token: SessionProcess}
+_processes = OrderedDict()
+_processes_lock = threading.Lock()
+_reaper = None
+
+
+def _reap_idle_processes():
+    """Close processes that have been idle longer than IDLE_TIMEOUT_MINUTES."""
+    while True:
+        time.sleep(REAP_INTERVAL_SECONDS)
+        cutoff = time.monotonic() - IDLE_TIMEOUT_MINUTES * 60
+        with _processes_lock:
+            idle = [key for key, process in _processes.items()
+                    if process.last_used < cutoff and not process.users]
+            reaped = [_processes.pop(key) for key in idle]
+        for process in reaped:
+            process.close()
+
+
+def _start_reaper():
+    global _reaper
+    if _reaper is None:
+        _reaper = threading.Thread(target=_reap_idle_processes, daemon=True)
+        _reaper.start()
+
+
+def _evict_lru() -> list:
+    """Pop idle processes, least recently used first, until there is room for one more."""
+    evicted = []
+    for key in list(_processes):
+        if len(_processes) < MAX_PROCESSES:
+            break
+        if not _processes[key].users:
+            evicted.append(_processes.pop(key))
+    return evicted
+
+
+def stream_reply(session_token: str, conversation_id: bytes, previous_id: Optional[bytes],
+                 message_id: bytes, prompt: str, message: str,
+                 env: dict, timeout: float) -> Iterator[str]:
+    """
+    Stream a reply from the session's long-lived process.
+
+    message_id is the id of the saved user message being answered, and
+    previous_id that of the conversation's user message before it (None if
+    there is none).
+
+    A session keeps one process, which is replaced when it moves to a
+    different conversation or the conversation has messages it hasn't seen.
+    If the session's process is busy when it would be replaced, a one-off
+    process is used for this reply and then closed.
+    """
+    stale = []
+    with _processes_lock:
+        _start_reaper()
+        process: Optional[SessionProcess] = _processes.get(session_token)
+        shared = True
+
+        if process is not None and not process.holds(conversation_id, previous_id):
+            if process.users:
+                shared = False
+            else:
+                stale.append(_processes.pop(session_token))
+            process = None
+
+        if process is None:
+            if shared:
+                stale.extend(_evict_lru())
+            process = SessionProcess(conversation_id, env)
+            if shared:
+                _processes[session_token] = process
+
+        if shared:
+            _processes.move_to_end(session_token)
+        # Claimed while still holding the lock, so the reaper and LRU
+        # eviction can't close it before the turn starts
+        process.users += 1
+        process.last_used = time.monotonic()
+
+    for old in stale:
+        old.close()
+
+    try:
+        yield from process.stream(prompt, message, message_id, timeout)
+    finally:
+        with _processes_lock:
+            process.users -= 1
+            if (not shared or not process.is_alive()) and _processes.get(session_token) is process:
+                del _processes[session_token]
+        if not shared:
+            process.close()
+
+
+def close_session(session_token: str):
+    """Close the process belonging to a session (e.g. on logout)."""
+    with _processes_lock:
+        process = _processes.pop(session_token, None)
+    if process is not None:
+        process.close()
+
+
+def close_conversation(conversation_id: bytes):
+    """Close any process holding a conversation (e.g. when it is deleted)."""
+    with _processes_lock:
+        keys = [key for key, process in _processes.items() if process.conversation_id == conversation_id]
+        closed = [_processes.pop(key) for key in keys]
+    for process in closed:
+        process.close()
@@ -0,0 +1,24 @@
+"""Gunicorn configuration for Claude Code Chat.
+
+Run with: gunicorn -c gunicorn_config.py app:app
+"""
+
+import os
+import multiprocessing
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', 5007)}"
+
+# Threaded workers, so a request waiting on the Claude CLI doesn't block others
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+
+# In-memory sessions are per process, so more than one worker needs Redis (REDIS_URL)
+default_workers = multiprocessing.cpu_count() * 2 + 1 if os.getenv("REDIS_URL") else 1
+workers = int(os.getenv("GUNICORN_WORKERS", default_workers))
+
+# Leave room for the CLI to hit its own timeout and report it
+timeout = int(os.getenv("CLAUDE_TIMEOUT", 120)) + 30
@@ -1,98 +1,289 @@
 """Database models for Claude Code Chat."""
 
+import os
+import time
 import sqlite3
+import threading
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from contextlib import contextmanager
 
 DATABASE_PATH = "claude_chat.db"
 
+# One long-lived connection per worker thread, opened lazily by get_db()
+_local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
+    """Open a new connection with per-connection tuning applied."""
+    conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+    # With WAL (set in init_db) readers don't block the writer, so the only
+    # waits are writer vs writer; give those time instead of failing fast
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA wal_autocheckpoint=1000")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-20000")
+    return conn
+
 
 @contextmanager
 def get_db():
-    """Context manager for database connections."""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
+    """
+    Context manager for database connections.
+
+    Reuses the calling thread's cached connection instead of reconnecting
+    on every call. Uncommitted work is rolled back if the block raises, so
+    the shared connection is never left mid-transaction.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = _connect()
     try:
         yield conn
-    finally:
-        conn.close()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+# Bumped whenever existing databases need migrating; stored in PRAGMA user_version
+SCHEMA_VERSION = 2
+
+# Table definitions, formatted with the table name so migrations can build a
+# replacement table alongside the old one. IDs are UUIDs stored as 16 bytes
+# and timestamps are integer milliseconds since the Unix epoch (UTC).
+_TABLES = {
+    # Users table - stores authenticated users
+    "users": """
+        CREATE TABLE IF NOT EXISTS {name} (
+            id BLOB PRIMARY KEY,
+            anthropic_user_id TEXT UNIQUE,
+            email TEXT,
+            name TEXT,
+            created_at INTEGER NOT NULL,
+            last_login_at INTEGER
+        )
+    """,
+    # Conversations table - stores chat sessions
+    "conversations": """
+        CREATE TABLE IF NOT EXISTS {name} (
+            id BLOB PRIMARY KEY,
+            user_id BLOB NOT NULL,
+            title TEXT,
+            created_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """,
+    # Messages table - stores individual messages
+    "messages": """
+        CREATE TABLE IF NOT EXISTS {name} (
+            id BLOB PRIMARY KEY,
+            conversation_id BLOB NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at INTEGER NOT NULL,
+            FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
+        )
+    """,
+}
+
+
+def _new_id() -> bytes:
+    """
+    Generate a random (version 4) UUID directly as 16 bytes.
+
+    Equivalent to uuid.uuid4().bytes without building a UUID object.
+    """
+    b = bytearray(os.urandom(16))
+    b[6] = b[6] & 0x0F | 0x40  # version 4
+    b[8] = b[8] & 0x3F | 0x80  # RFC 4122 variant
+    return bytes(b)
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_last_timestamp = 0
+_timestamp_lock = threading.Lock()
+
+
+def _now_ms() -> int:
+    """
+    Get the current time in epoch milliseconds.
+
+    Values from one process are strictly increasing, so rows written within
+    the same millisecond still sort in the order they were created.
+    """
+    global _last_timestamp
+    with _timestamp_lock:
+        _last_timestamp = max(time.time_ns() // 1_000_000, _last_timestamp + 1)
+        return _last_timestamp
+
+
+def _format_timestamp(ms: Optional[int]) -> Optional[str]:
+    """Format epoch milliseconds as an ISO 8601 UTC string for the API."""
+    if ms is None:
+        return None
+    return (_EPOCH + timedelta(milliseconds=ms)).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def _iso_to_ms(value) -> Optional[int]:
+    """Convert a naive UTC ISO timestamp from the old schema to epoch milliseconds."""
+    if value is None or isinstance(value, int):
+        return value
+    dt = datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+    return (dt - _EPOCH) // timedelta(milliseconds=1)
+
+
+def encode_id(id: bytes) -> str:
+    """Format a stored 16-byte ID as the UUID string used in the API."""
+    return str(uuid.UUID(bytes=id))
+
+
+def decode_id(value) -> Optional[bytes]:
+    """Convert an API UUID string to its stored 16-byte form, or None if malformed."""
+    if isinstance(value, bytes):
+        return value
+    try:
+        return uuid.UUID(value).bytes
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def _rebuild_table(cursor: sqlite3.Cursor, table: str, select: str):
+    """Recreate a table with its current definition, copying rows through `select`."""
+    cursor.execute(_TABLES[table].format(name=f"{table}_new"))
+    cursor.execute(f"INSERT INTO {table}_new SELECT {select} FROM {table} ORDER BY rowid")
+    cursor.execute(f"DROP TABLE {table}")
+    cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+
+def _migrate_uuid_blobs(cursor: sqlite3.Cursor):
+    """Version 1: store UUID primary and foreign keys as 16-byte BLOBs instead of TEXT."""
+    _rebuild_table(cursor, "users",
+                   "uuid_blob(id), anthropic_user_id, email, name, created_at, last_login_at")
+    _rebuild_table(cursor, "conversations",
+                   "uuid_blob(id), uuid_blob(user_id), title, created_at, updated_at")
+    _rebuild_table(cursor, "messages",
+                   "uuid_blob(id), uuid_blob(conversation_id), role, content, created_at")
+
+
+def _migrate_epoch_timestamps(cursor: sqlite3.Cursor):
+    """Version 2: store timestamps as INTEGER epoch milliseconds instead of ISO TEXT."""
+    _rebuild_table(cursor, "users",
+                   "id, anthropic_user_id, email, name, iso_to_ms(created_at), iso_to_ms(last_login_at)")
+    _rebuild_table(cursor, "conversations",
+                   "id, user_id, title, iso_to_ms(created_at), iso_to_ms(updated_at)")
+    _rebuild_table(cursor, "messages",
+                   "id, conversation_id, role, content, iso_to_ms(created_at)")
+
+
+# Migration applied to move a database to each schema version
+_MIGRATIONS = {
+    1: _migrate_uuid_blobs,
+    2: _migrate_epoch_timestamps,
+}
+
+
+def _migrate(conn: sqlite3.Connection, version: int):
+    """Bring a database created by an older version of the app up to date."""
+    conn.create_function("uuid_blob", 1, decode_id, deterministic=True)
+    conn.create_function("iso_to_ms", 1, _iso_to_ms, deterministic=True)
+
+    cursor = conn.cursor()
+    cursor.execute("BEGIN")
+    for target in range(version + 1, SCHEMA_VERSION + 1):
+        _MIGRATIONS[target](cursor)
+    conn.commit()
 
 
 def init_db():
-    """Initialize the database with required tables."""
+    """Initialize the database with required tables, migrating older schemas."""
     with get_db() as conn:
         cursor = conn.cursor()
 
-        # Users table - stores authenticated users
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id TEXT PRIMARY KEY,
-                anthropic_user_id TEXT UNIQUE,
-                email TEXT,
-                name TEXT,
-                created_at TEXT NOT NULL,
-                last_login_at TEXT
-            )
-        """)
-
-        # Conversations table - stores chat sessions
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS conversations (
-                id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                title TEXT,
-                created_at TEXT NOT NULL,
-                updated_at TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        """)
-
-        # Messages table - stores individual messages
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                id TEXT PRIMARY KEY,
-                conversation_id TEXT NOT NULL,
-                role TEXT NOT NULL,
-                content TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
-            )
-        """)
+        # WAL is persistent in the database file, so it only needs setting once
+        cursor.execute("PRAGMA journal_mode=WAL")
 
-        # Create indexes for performance
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversations_user_id ON conversations(user_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages(conversation_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversations_updated_at ON conversations(updated_at)")
+        cursor.execute("PRAGMA user_version")
+        version = cursor.fetchone()[0]
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'")
+        if cursor.fetchone() is not None and version < SCHEMA_VERSION:
+            _migrate(conn, version)
 
+        for table, create_sql in _TABLES.items():
+            cursor.execute(create_sql.format(name=table))
+
+        # Create indexes for performance. The composite indexes match the
+        # filter + ORDER BY of the hot queries, so no separate sort is needed.
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_messages_conv_created'")
+        indexes_exist = cursor.fetchone() is not None
+
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_conv_created ON messages(conversation_id, created_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversations_user_updated ON conversations(user_id, updated_at DESC)")
+
+        # Superseded by the composite indexes above
+        cursor.execute("DROP INDEX IF EXISTS idx_conversations_user_id")
+        cursor.execute("DROP INDEX IF EXISTS idx_messages_conversation_id")
+        cursor.execute("DROP INDEX IF EXISTS idx_conversations_updated_at")
+
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         conn.commit()
 
+        if not indexes_exist:
+            # Gather statistics once so the planner picks the new indexes
+            cursor.execute("ANALYZE")
+            conn.commit()
+
+
+# Hot-path queries. Like every model query, they list columns in constructor
+# order so rows (plain tuples) can be unpacked positionally into cls(*row).
+_Q_USER_BY_ID = (
+    "SELECT id, anthropic_user_id, email, name, created_at, last_login_at "
+    "FROM users WHERE id = ?"
+)
+_Q_CONVERSATION_BY_ID = (
+    "SELECT id, user_id, title, created_at, updated_at "
+    "FROM conversations WHERE id = ?"
+)
+# LIMIT -1 means no limit in SQLite. rowid breaks ties between messages
+# created within the same millisecond.
+_Q_MESSAGES_BY_CONVERSATION = """
+    SELECT id, conversation_id, role, content, created_at FROM (
+        SELECT *, rowid AS seq FROM messages
+        WHERE conversation_id = ?
+        ORDER BY created_at DESC, rowid DESC
+        LIMIT ?
+    )
+    ORDER BY created_at ASC, seq ASC
+"""
+
+# Column list shared by the conversation + messages JOIN queries: the
+# Conversation constructor columns followed by the message columns
+_CONVERSATION_WITH_MESSAGES_COLUMNS = """
+    c.id, c.user_id, c.title, c.created_at, c.updated_at,
+    m.id AS m_id, m.role AS m_role, m.content AS m_content, m.created_at AS m_created_at
+"""
+
 
 class User:
     """User model for authenticated users."""
 
-    def __init__(self, id: str, anthropic_user_id: str, email: Optional[str] = None,
-                 name: Optional[str] = None, created_at: Optional[str] = None,
-                 last_login_at: Optional[str] = None):
+    def __init__(self, id: bytes, anthropic_user_id: str, email: Optional[str] = None,
+                 name: Optional[str] = None, created_at: Optional[int] = None,
+                 last_login_at: Optional[int] = None, /):
         self.id = id
         self.anthropic_user_id = anthropic_user_id
         self.email = email
         self.name = name
-        self.created_at = created_at or datetime.utcnow().isoformat()
+        self.created_at = created_at or _now_ms()
         self.last_login_at = last_login_at
 
     @classmethod
     def create(cls, anthropic_user_id: str, email: Optional[str] = None,
                name: Optional[str] = None) -> "User":
         """Create a new user."""
-        user = cls(
-            id=str(uuid.uuid4()),
-            anthropic_user_id=anthropic_user_id,
-            email=email,
-            name=name,
-            created_at=datetime.utcnow().isoformat()
-        )
+        user = cls(_new_id(), anthropic_user_id, email, name, _now_ms())
 
         with get_db() as conn:
             cursor = conn.cursor()
@@ -109,28 +300,30 @@ class User:
         """Get user by Anthropic user ID."""
         with get_db() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE anthropic_user_id = ?", (anthropic_user_id,))
+            cursor.execute(
+                "SELECT id, anthropic_user_id, email, name, created_at, last_login_at "
+                "FROM users WHERE anthropic_user_id = ?",
+                (anthropic_user_id,)
+            )
             row = cursor.fetchone()
 
-            if row:
-                return cls(**dict(row))
-        return None
+        return cls(*row) if row else None
 
     @classmethod
-    def get_by_id(cls, user_id: str) -> Optional["User"]:
-        """Get user by ID."""
+    def get_by_id(cls, user_id) -> Optional["User"]:
+        """Get user by ID, given as stored bytes or an API UUID string."""
+        user_id = decode_id(user_id)
+        if user_id is None:
+            return None
+
         with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-            row = cursor.fetchone()
+            row = conn.execute(_Q_USER_BY_ID, (user_id,)).fetchone()
 
-            if row:
-                return cls(**dict(row))
-        return None
+        return cls(*row) if row else None
 
     def update_last_login(self):
         """Update user's last login timestamp."""
-        self.last_login_at = datetime.utcnow().isoformat()
+        self.last_login_at = _now_ms()
         with get_db() as conn:
             cursor = conn.cursor()
             cursor.execute(
@@ -142,35 +335,31 @@ class User:
     def to_dict(self) -> dict:
         """Convert user to dictionary."""
         return {
-            "id": self.id,
+            "id": encode_id(self.id),
             "email": self.email,
             "name": self.name,
-            "created_at": self.created_at
+            "created_at": _format_timestamp(self.created_at)
         }
 
 
 class Conversation:
     """Conversation model for chat sessions."""
 
-    def __init__(self, id: str, user_id: str, title: Optional[str] = None,
-                 created_at: Optional[str] = None, updated_at: Optional[str] = None):
+    def __init__(self, id: bytes, user_id: bytes, title: Optional[str] = None,
+                 created_at: Optional[int] = None, updated_at: Optional[int] = None, /):
         self.id = id
         self.user_id = user_id
         self.title = title
-        self.created_at = created_at or datetime.utcnow().isoformat()
+        self.created_at = created_at or _now_ms()
         self.updated_at = updated_at or self.created_at
+        # Populated when loaded together with messages in a single query
+        self.messages: Optional[list["Message"]] = None
 
     @classmethod
-    def create(cls, user_id: str, title: Optional[str] = None) -> "Conversation":
+    def create(cls, user_id: bytes, title: Optional[str] = None) -> "Conversation":
         """Create a new conversation."""
-        now = datetime.utcnow().isoformat()
-        conversation = cls(
-            id=str(uuid.uuid4()),
-            user_id=user_id,
-            title=title or "New Conversation",
-            created_at=now,
-            updated_at=now
-        )
+        now = _now_ms()
+        conversation = cls(_new_id(), user_id, title or "New Conversation", now, now)
 
         with get_db() as conn:
             cursor = conn.cursor()
@@ -184,52 +373,113 @@ class Conversation:
         return conversation
 
     @classmethod
-    def get_by_id(cls, conversation_id: str) -> Optional["Conversation"]:
-        """Get conversation by ID."""
+    def get_by_id(cls, conversation_id) -> Optional["Conversation"]:
+        """Get conversation by ID, given as stored bytes or an API UUID string."""
+        conversation_id = decode_id(conversation_id)
+        if conversation_id is None:
+            return None
+
         with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM conversations WHERE id = ?", (conversation_id,))
-            row = cursor.fetchone()
+            row = conn.execute(_Q_CONVERSATION_BY_ID, (conversation_id,)).fetchone()
 
-            if row:
-                return cls(**dict(row))
-        return None
+        return cls(*row) if row else None
 
     @classmethod
-    def get_by_user(cls, user_id: str, limit: int = 50) -> list["Conversation"]:
+    def get_by_user(cls, user_id: bytes, limit: int = 50) -> list["Conversation"]:
         """Get all conversations for a user, ordered by most recent."""
         with get_db() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                SELECT * FROM conversations
+                SELECT id, user_id, title, created_at, updated_at FROM conversations
                 WHERE user_id = ?
                 ORDER BY updated_at DESC
                 LIMIT ?
             """, (user_id, limit))
             rows = cursor.fetchall()
 
-            return [cls(**dict(row)) for row in rows]
+        return [cls(*row) for row in rows]
 
-    def update_title(self, title: str):
-        """Update conversation title."""
-        self.title = title
-        self.updated_at = datetime.utcnow().isoformat()
+    @classmethod
+    def list_version(cls, user_id: bytes) -> tuple:
+        """
+        Get a cheap fingerprint of a user's conversation list.
+
+        Any create, rename, new message or delete changes either the latest
+        updated_at or the count, so the pair can key a cache of the list.
+        """
         with get_db() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                "UPDATE conversations SET title = ?, updated_at = ? WHERE id = ?",
-                (self.title, self.updated_at, self.id)
+                "SELECT MAX(updated_at), COUNT(*) FROM conversations WHERE user_id = ?",
+                (user_id,)
             )
-            conn.commit()
+            return tuple(cursor.fetchone())
+
+    @classmethod
+    def get_with_messages(cls, conversation_id) -> Optional["Conversation"]:
+        """Get a conversation and its messages in a single query."""
+        conversation_id = decode_id(conversation_id)
+        if conversation_id is None:
+            return None
 
-    def touch(self):
-        """Update the conversation's updated_at timestamp."""
-        self.updated_at = datetime.utcnow().isoformat()
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT {_CONVERSATION_WITH_MESSAGES_COLUMNS}
+                FROM conversations c
+                LEFT JOIN messages m ON m.conversation_id = c.id
+                WHERE c.id = ?
+                ORDER BY m.created_at ASC, m.rowid ASC
+            """, (conversation_id,))
+            conversations = cls._from_joined_rows(cursor.fetchall())
+
+        return conversations[0] if conversations else None
+
+    @classmethod
+    def get_by_user_with_messages(cls, user_id: bytes, limit: int = 50) -> list["Conversation"]:
+        """Get a user's most recent conversations with their messages in a single query."""
+        with get_db() as conn:
+            cursor = conn.cursor()
+            # The LIMIT applies to conversations, not to joined message rows
+            cursor.execute(f"""
+                SELECT {_CONVERSATION_WITH_MESSAGES_COLUMNS}
+                FROM (
+                    SELECT * FROM conversations
+                    WHERE user_id = ?
+                    ORDER BY updated_at DESC
+                    LIMIT ?
+                ) c
+                LEFT JOIN messages m ON m.conversation_id = c.id
+                ORDER BY c.updated_at DESC, m.created_at ASC, m.rowid ASC
+            """, (user_id, limit))
+            return cls._from_joined_rows(cursor.fetchall())
+
+    @classmethod
+    def _from_joined_rows(cls, rows) -> list["Conversation"]:
+        """Group conversation/message join rows into conversations with messages attached."""
+        conversations = {}
+        for row in rows:
+            conversation = conversations.get(row[0])
+            if conversation is None:
+                conversation = cls(*row[:5])
+                conversation.messages = []
+                conversations[conversation.id] = conversation
+
+            m_id, role, content, created_at = row[5:]
+            if m_id is not None:
+                conversation.messages.append(Message(m_id, conversation.id, role, content, created_at))
+
+        return list(conversations.values())
+
+    def update_title(self, title: str):
+        """Update conversation title."""
+        self.title = title
+        self.updated_at = _now_ms()
         with get_db() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                "UPDATE conversations SET updated_at = ? WHERE id = ?",
-                (self.updated_at, self.id)
+                "UPDATE conversations SET title = ?, updated_at = ? WHERE id = ?",
+                (self.title, self.updated_at, self.id)
             )
             conn.commit()
 
@@ -241,17 +491,21 @@ class Conversation:
             cursor.execute("DELETE FROM conversations WHERE id = ?", (self.id,))
             conn.commit()
 
-    def get_messages(self) -> list["Message"]:
-        """Get all messages in this conversation."""
-        return Message.get_by_conversation(self.id)
+    def get_messages(self, limit: Optional[int] = None) -> list["Message"]:
+        """Get messages in this conversation, optionally only the most recent `limit`."""
+        if self.messages is not None:
+            if limit is None:
+                return self.messages
+            return self.messages[-limit:] if limit > 0 else []
+        return Message.get_by_conversation(self.id, limit)
 
     def to_dict(self, include_messages: bool = False) -> dict:
         """Convert conversation to dictionary."""
         result = {
-            "id": self.id,
+            "id": encode_id(self.id),
             "title": self.title,
-            "created_at": self.created_at,
-            "updated_at": self.updated_at
+            "created_at": _format_timestamp(self.created_at),
+            "updated_at": _format_timestamp(self.updated_at)
         }
 
         if include_messages:
@@ -263,60 +517,68 @@ class Conversation:
 class Message:
     """Message model for individual chat messages."""
 
-    def __init__(self, id: str, conversation_id: str, role: str, content: str,
-                 created_at: Optional[str] = None):
+    def __init__(self, id: bytes, conversation_id: bytes, role: str, content: str,
+                 created_at: Optional[int] = None, /):
         self.id = id
         self.conversation_id = conversation_id
         self.role = role  # 'user' or 'assistant'
         self.content = content
-        self.created_at = created_at or datetime.utcnow().isoformat()
+        self.created_at = created_at or _now_ms()
 
     @classmethod
-    def create(cls, conversation_id: str, role: str, content: str) -> "Message":
-        """Create a new message."""
-        message = cls(
-            id=str(uuid.uuid4()),
-            conversation_id=conversation_id,
-            role=role,
-            content=content,
-            created_at=datetime.utcnow().isoformat()
-        )
-
+    def create(cls, conversation_id: bytes, role: str, content: str) -> "Message":
+        """Create a new message and bump its conversation's updated_at in one transaction."""
         with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO messages (id, conversation_id, role, content, created_at)
-                VALUES (?, ?, ?, ?, ?)
-            """, (message.id, message.conversation_id, message.role,
-                  message.content, message.created_at))
-            conn.commit()
+            return cls.create_bulk(conn, conversation_id, [(role, content)])[0]
+
+    @classmethod
+    def create_bulk(cls, conn: sqlite3.Connection, conversation_id: bytes,
+                    rows: list[tuple[str, str]]) -> list["Message"]:
+        """
+        Insert (role, content) rows into a conversation on the given connection.
+
+        The conversation's updated_at is bumped in the same transaction, which
+        is committed once at the end.
+        """
+        messages = [
+            cls(_new_id(), conversation_id, role, content, _now_ms())
+            for role, content in rows
+        ]
 
-        # Touch the conversation to update its updated_at
-        conversation = Conversation.get_by_id(conversation_id)
-        if conversation:
-            conversation.touch()
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT INTO messages (id, conversation_id, role, content, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(m.id, m.conversation_id, m.role, m.content, m.created_at) for m in messages])
+        cursor.execute(
+            "UPDATE conversations SET updated_at = ? WHERE id = ?",
+            (messages[-1].created_at, conversation_id)
+        )
+        conn.commit()
 
-        return message
+        return messages
 
     @classmethod
-    def get_by_conversation(cls, conversation_id: str) -> list["Message"]:
-        """Get all messages in a conversation, ordered by creation time."""
+    def get_by_conversation(cls, conversation_id: bytes,
+                            limit: Optional[int] = None) -> list["Message"]:
+        """
+        Get messages in a conversation, ordered by creation time.
+
+        If limit is given, only the most recent `limit` messages are returned.
+        """
         with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT * FROM messages
-                WHERE conversation_id = ?
-                ORDER BY created_at ASC
-            """, (conversation_id,))
-            rows = cursor.fetchall()
+            rows = conn.execute(
+                _Q_MESSAGES_BY_CONVERSATION,
+                (conversation_id, -1 if limit is None else limit)
+            ).fetchall()
 
-            return [cls(**dict(row)) for row in rows]
+        return [cls(*row) for row in rows]
 
     def to_dict(self) -> dict:
         """Convert message to dictionary."""
         return {
-            "id": self.id,
+            "id": encode_id(self.id),
             "role": self.role,
             "content": self.content,
-            "created_at": self.created_at
+            "created_at": _format_timestamp(self.created_at)
         }
@@ -435,31 +435,73 @@ async function sendMessage(message) {
     const loadingEl = addMessage('assistant', getRandomThinkingPhrase(), true);
 
     try {
-        const data = await apiRequest('/api/chat', {
+        const headers = { 'Content-Type': 'application/json' };
+        if (state.sessionToken) {
+            headers['Authorization'] = `Bearer ${state.sessionToken}`;
+        }
+
+        const response = await fetch('/api/chat/stream', {
             method: 'POST',
+            headers,
             body: JSON.stringify({
                 message,
                 conversation_id: state.currentConversationId,
             }),
         });
 
-        if (data.success) {
-            // Update loading message with response
-            loadingEl.classList.remove('loading');
-            loadingEl.innerHTML = formatMarkdown(data.response);
+        if (!response.ok) {
+            const data = await response.json();
+            throw new Error(data.error || 'Request failed');
+        }
+
+        let assistantResponse = '';
+        let conversationId = null;
+        let error = null;
+
+        // Read Server-Sent Events frames as they arrive
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+
+            buffer += decoder.decode(value, { stream: true });
+            const frames = buffer.split('\n\n');
+            buffer = frames.pop();
+
+            for (const frame of frames) {
+                if (!frame.startsWith('data: ')) continue;
+                const event = JSON.parse(frame.slice(6));
+
+                if (event.conversation_id) {
+                    conversationId = event.conversation_id;
+                } else if (event.token) {
+                    assistantResponse += event.token;
+                    loadingEl.classList.remove('loading');
+                    loadingEl.innerHTML = formatMarkdown(assistantResponse);
+                    chatMessages.scrollTop = chatMessages.scrollHeight;
+                } else if (event.error) {
+                    error = event.error;
+                }
+            }
+        }
 
+        if (error) {
+            loadingEl.classList.add('loading');
+            loadingEl.innerHTML = `<em>Error: ${escapeHtml(error)}</em>`;
+        } else {
             // Update state
             state.chatHistory.push({ role: 'user', content: message });
-            state.chatHistory.push({ role: 'assistant', content: data.response });
+            state.chatHistory.push({ role: 'assistant', content: assistantResponse });
+        }
 
-            // Update conversation ID if new
-            if (data.conversation_id && data.conversation_id !== state.currentConversationId) {
-                state.currentConversationId = data.conversation_id;
-                deleteChatBtn.style.display = 'flex';
-                await loadConversations();
-            }
-        } else {
-            loadingEl.innerHTML = `<em>Error: ${data.error}</em>`;
+        // Update conversation ID if new
+        if (conversationId && conversationId !== state.currentConversationId) {
+            state.currentConversationId = conversationId;
+            deleteChatBtn.style.display = 'flex';
+            await loadConversations();
         }
     } catch (error) {
         loadingEl.innerHTML = `<em>Error: ${error.message}</em>`;